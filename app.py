@@ -1,10 +1,17 @@
 import math
+import os
+import tempfile
+import threading
 import time
 from datetime import datetime
+from pathlib import Path
 from typing import Optional, List, Dict, Tuple
 
+import numpy as np
+import orjson
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go  # for median reference trace
@@ -16,6 +23,8 @@ st.set_page_config(page_title="India Indicators", page_icon="📊", layout="wide
 # ======================
 WB_BASE = "https://api.worldbank.org/v2"
 DEFAULT_COUNTRY = "IND"
+WB_COLUMNS = ["country", "iso3", "indicator", "date", "value"]
+DISK_CACHE_DIR = Path(__file__).parent / ".wbcache"
 
 COUNTRY_LABELS: Dict[str, str] = {
     "IND": "India", "CHN": "China", "USA": "United States", "BGD": "Bangladesh",
@@ -58,17 +67,67 @@ GLOSSARY = {
     "EN.ATM.CO2E.PC": "CO₂ emissions (metric tons per capita).",
 }
 
+_INDICATOR_LABELS = tuple(INDICATORS.keys())
+_INDICATOR_INDEX = {k: i for i, k in enumerate(_INDICATOR_LABELS)}
+_PRESET_OPTIONS = ("None",) + tuple(PRESETS.keys())
+_PRESET_INDEX = {k: i for i, k in enumerate(_PRESET_OPTIONS)}
+_PEER_NAMES = tuple(PEERS.keys())
+
+# Cache lifetime (seconds) by how often the series actually moves; WB annual data changes rarely.
+DEFAULT_TTL = 60 * 60
+STALE_RETRY_TTL = 5 * 60  # how long to serve on-disk fallback before retrying a failed API
+VALIDATOR_STORE_SIZE = 64  # country-set URLs whose validators are kept for conditional GETs
+INDICATOR_TTL: Dict[str, int] = {
+    "FP.CPI.TOTL.ZG": 6 * 3600,
+    "SL.UEM.TOTL.ZS": 6 * 3600,
+    "NY.GDP.MKTP.CD": 24 * 3600,
+    "NY.GDP.PCAP.CD": 24 * 3600,
+    "SP.DYN.LE00.IN": 7 * 24 * 3600,
+    "SP.POP.TOTL": 7 * 24 * 3600,
+    "EN.ATM.CO2E.PC": 7 * 24 * 3600,
+}
+
+VIEWS = ("Overview", "Compare", "Forecast", "Data & Glossary")
+
 MIN_YEAR = 1960
 MAX_YEAR = datetime.now().year
 
+# Smoothing runs through pandas' numba kernels; JIT is warmed once per process (see _warm_rolling_jit).
+ROLLING_ENGINE = {"engine": "numba", "engine_kwargs": {"nopython": True, "parallel": False}}
+
 # ======================
 # Data Access (cached)
 # ======================
-def _safe_request(url: str, params: dict, retries: int = 3, backoff: float = 0.6):
+def indicator_ttl(indicator_code: str) -> int:
+    return INDICATOR_TTL.get(indicator_code, DEFAULT_TTL)
+
+@st.cache_resource(show_spinner=False)
+def _http_session() -> requests.Session:
+    """Pooled keep-alive session, shared across reruns (the script body re-executes each time)."""
+    session = requests.Session()
+    session.headers.update({"Accept-Encoding": "gzip", "Connection": "keep-alive"})
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=0))
+    return session
+
+@st.cache_resource(show_spinner=False, ttl=max(INDICATOR_TTL.values()))
+def _validator_store() -> Dict[str, Tuple[Optional[str], Optional[str], pd.DataFrame]]:
+    """url -> (ETag, Last-Modified, parsed frame) from the last 200 response, for conditional GETs.
+
+    Bounded to VALIDATOR_STORE_SIZE entries (oldest evicted first).
+    """
+    return {}
+
+@st.cache_resource(show_spinner=False)
+def _validator_lock() -> threading.Lock:
+    """Serialises writes/evictions on the store, which every session thread shares."""
+    return threading.Lock()
+
+def _safe_request(url: str, params: dict, retries: int = 3, backoff: float = 0.6,
+                  headers: Optional[dict] = None):
     last_exc = None
     for i in range(retries):
         try:
-            r = requests.get(url, params=params, timeout=30)
+            r = _http_session().get(url, params=params, headers=headers, timeout=30)
             r.raise_for_status()
             return r
         except Exception as e:
@@ -76,84 +135,244 @@ def _safe_request(url: str, params: dict, retries: int = 3, backoff: float = 0.6
             time.sleep(backoff * (2 ** i))
     raise last_exc
 
-@st.cache_data(show_spinner=False, ttl=60 * 60)
-def wb_fetch_series(country_code: str, indicator_code: str) -> pd.DataFrame:
-    url = f"{WB_BASE}/country/{country_code}/indicator/{indicator_code}"
-    params = {"format": "json", "per_page": 20000}
-    out = []
-    page = 1
-    while True:
-        params["page"] = page
-        r = _safe_request(url, params)
-        data = r.json()
-        if not isinstance(data, list) or len(data) < 2:
-            break
-        meta, rows = data
-        out.extend(rows)
-        if page >= meta.get("pages", 1):
-            break
-        page += 1
-    if not out:
-        return pd.DataFrame(columns=["country", "iso3", "indicator", "date", "value"])
-    df = pd.json_normalize(out).rename(columns={
-        "country.value": "country",
-        "countryiso3code": "iso3",
-        "indicator.id": "indicator",
-        "date": "date",
-        "value": "value",
-    })
+def _wb_fetch_page(url: str, page: int, headers: Optional[dict] = None) -> Tuple[requests.Response, dict, list]:
+    r = _safe_request(url, {"format": "json", "per_page": 20000, "page": page}, headers=headers)
+    if r.status_code == 304:
+        return r, {}, []
+    data = orjson.loads(r.content)
+    if isinstance(data, list) and data and isinstance(data[0], dict) and "message" in data[0]:
+        # WB reports errors as HTTP 200 with [{"message": [...]}]; don't mistake that for "no rows".
+        raise requests.HTTPError(f"World Bank API error: {data[0]['message']}", response=r)
+    if not isinstance(data, list) or len(data) < 2:
+        return r, {}, []
+    meta, rows = data
+    return r, meta, rows or []
+
+def _finalize_frame(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.dropna(subset=["date"]).sort_values(["iso3", "date"], kind="stable")
+    df["iso3"] = df["iso3"].astype(str).astype("category")
+    df["indicator"] = df["indicator"].astype(str).astype("category")
+    df["date"] = df["date"].astype("int16")
+    df["value"] = df["value"].astype("float64")
+    return df[WB_COLUMNS].reset_index(drop=True)
+
+def _wb_download(countries: List[str], indicator_code: str) -> pd.DataFrame:
+    url = f"{WB_BASE}/country/{';'.join(countries)}/indicator/{indicator_code}"
+    store = _validator_store()
+    cached = store.get(url)
+    headers = {}
+    if cached is not None:
+        etag, last_modified, _ = cached
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+    r, meta, rows = _wb_fetch_page(url, 1, headers=headers)
+    if r.status_code == 304 and cached is not None:
+        return cached[2]
+    out = list(rows)
+    for page in range(2, (meta.get("pages", 1) or 1) + 1):
+        out.extend(_wb_fetch_page(url, page)[2])
+    df = pd.DataFrame({
+        "country": [x["country"]["value"] for x in out],
+        "iso3": [x["countryiso3code"] for x in out],
+        "indicator": [x["indicator"]["id"] for x in out],
+        "date": [x["date"] for x in out],
+        "value": [x["value"] for x in out],
+    }, columns=WB_COLUMNS)
     df["date"] = pd.to_numeric(df["date"], errors="coerce")
     df["value"] = pd.to_numeric(df["value"], errors="coerce")
-    df = df.dropna(subset=["date"]).sort_values("date")
-    df["iso3"] = df["iso3"].astype("category")
-    df["indicator"] = df["indicator"].astype("category")
-    return df[["country", "iso3", "indicator", "date", "value"]]
+    df = _finalize_frame(df)
+    etag, last_modified = r.headers.get("ETag"), r.headers.get("Last-Modified")
+    if etag or last_modified:
+        with _validator_lock():
+            store.pop(url, None)
+            store[url] = (etag, last_modified, df)
+            while len(store) > VALIDATOR_STORE_SIZE:
+                store.pop(next(iter(store)))
+    return df
+
+def _disk_cache_path(country_code: str, indicator_code: str) -> Path:
+    return DISK_CACHE_DIR / f"{country_code}_{indicator_code}.parquet"
+
+def _read_disk_cache(country_code: str, indicator_code: str, max_age: float) -> Optional[pd.DataFrame]:
+    path = _disk_cache_path(country_code, indicator_code)
+    try:
+        if time.time() - path.stat().st_mtime > max_age:
+            return None
+        return pd.read_parquet(path)
+    except Exception:
+        return None
+
+def _write_disk_cache(df: pd.DataFrame, countries: List[str], indicator_code: str) -> None:
+    # Best effort: a read-only or full disk just means the next cold start refetches.
+    try:
+        DISK_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    except Exception:
+        return
+    for c in countries:
+        rows = df[df["iso3"] == c]
+        if rows.empty:
+            continue  # never replace a last-known-good copy with nothing
+        # Write to a temp file and rename so readers never see a half-written parquet.
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(dir=DISK_CACHE_DIR, suffix=".tmp")
+            os.close(fd)
+            rows.to_parquet(tmp, index=False)
+            os.replace(tmp, _disk_cache_path(c, indicator_code))
+        except Exception:
+            if tmp is not None:
+                try: os.remove(tmp)
+                except OSError: pass
+
+def _wb_fetch_multi(countries: List[str], indicator_code: str) -> pd.DataFrame:
+    if not countries:
+        return pd.DataFrame(columns=WB_COLUMNS)
+    frames, missing = [], []
+    for c in countries:
+        # Only copies written in the current TTL bucket count as fresh (see wb_fetch_multi).
+        cached = _read_disk_cache(c, indicator_code, max_age=time.time() % indicator_ttl(indicator_code))
+        if cached is not None:
+            frames.append(cached)
+        else:
+            missing.append(c)
+    if missing:
+        fetched = _wb_download(missing, indicator_code)
+        _write_disk_cache(fetched, missing, indicator_code)
+        frames.append(fetched)
+    df = _finalize_frame(pd.concat(frames, ignore_index=True))
+    df.attrs["version"] = f"{time.time():.0f}"
+    return df
+
+@st.cache_resource(show_spinner=False, ttl=max(INDICATOR_TTL.values()), max_entries=256)
+def _cached_wb_fetch_multi(countries: List[str], indicator_code: str, ttl_bucket: int) -> pd.DataFrame:
+    """`ttl_bucket` only feeds the cache key; it advances every indicator_ttl(code) seconds."""
+    return _wb_fetch_multi(countries, indicator_code)
+
+@st.cache_resource(show_spinner=False, ttl=STALE_RETRY_TTL)
+def _stale_frames() -> Dict[Tuple[str, Tuple[str, ...]], pd.DataFrame]:
+    """Fallback frames served while upstream is down; dropped after STALE_RETRY_TTL to retry."""
+    return {}
+
+def _read_stale_disk_cache(countries: List[str], indicator_code: str) -> Optional[pd.DataFrame]:
+    """Last known-good parquet copies regardless of age, or None if any country is missing."""
+    frames, oldest = [], None
+    for c in countries:
+        path = _disk_cache_path(c, indicator_code)
+        try:
+            mtime = path.stat().st_mtime
+            frames.append(pd.read_parquet(path))
+        except Exception:
+            return None
+        oldest = mtime if oldest is None else min(oldest, mtime)
+    if not frames:
+        return None
+    df = _finalize_frame(pd.concat(frames, ignore_index=True))
+    df.attrs["stale_as_of"] = datetime.fromtimestamp(oldest).strftime("%Y-%m-%d %H:%M")
+    df.attrs["version"] = f"stale:{oldest:.0f}"
+    return df
 
-@st.cache_data(show_spinner=False, ttl=60 * 60)
 def wb_fetch_multi(countries: List[str], indicator_code: str) -> pd.DataFrame:
-    frames = [wb_fetch_series(c, indicator_code) for c in countries]
-    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    """Fetch an indicator for all countries in one request (WB accepts ';'-joined ISO3 codes).
+
+    Countries with a fresh parquet copy in DISK_CACHE_DIR are read from disk instead.
+    Cached as a shared resource (no copy on hit) per TTL bucket (time // indicator_ttl(code)):
+    treat the returned frame as read-only. attrs["version"] changes whenever the data is
+    re-assembled, for use in downstream cache keys. If the API is unreachable, the last
+    parquet copies are returned with attrs["stale_as_of"] set.
+    """
+    key = (indicator_code, tuple(countries))
+    stale = _stale_frames()
+    if key in stale:
+        return stale[key]
+    try:
+        ttl_bucket = int(time.time() // indicator_ttl(indicator_code))
+        return _cached_wb_fetch_multi(countries, indicator_code, ttl_bucket)
+    except (requests.RequestException, orjson.JSONDecodeError):
+        fallback = _read_stale_disk_cache(countries, indicator_code)
+        if fallback is None:
+            raise
+        stale[key] = fallback
+        return fallback
+
+def wb_fetch_series(country_code: str, indicator_code: str) -> pd.DataFrame:
+    return wb_fetch_multi([country_code], indicator_code)
+
+@st.cache_data(show_spinner=False, ttl=60 * 60)
+def build_panel(countries: Tuple[str, ...], indicator_code: str,
+                data_version: Optional[str] = None) -> pd.DataFrame:
+    """Fully assembled long-format frame with display labels; pass a sorted tuple for a stable key.
+
+    `data_version` (wb_fetch_multi's attrs["version"]) only feeds the cache key, so the panel is
+    rebuilt whenever the underlying data is refreshed or switches to/from fallback data.
+    """
+    df = wb_fetch_multi(list(countries), indicator_code).copy()
+    df["iso3"] = df["iso3"].astype("category")
+    # Relabel via the (few) categories rather than mapping every row.
+    country = df["iso3"].cat.rename_categories(
+        {iso: COUNTRY_LABELS.get(iso, iso) for iso in df["iso3"].cat.categories})
+    # Order categories by label so sorting on country stays alphabetical, not by ISO code.
+    df["country"] = country.cat.reorder_categories(sorted(country.cat.categories))
+    return df
 
 # ======================
 # Metrics & Utils
 # ======================
-def latest_non_null(df: pd.DataFrame) -> Optional[pd.Series]:
-    clean = df.dropna(subset=["value"]).sort_values("date")
-    return clean.iloc[-1] if len(clean) else None
+def india_kpis(df: pd.DataFrame, n: int = 5) -> dict:
+    """Latest value/year, YoY % and n-year CAGR in one pass over a date-sorted frame."""
+    kpis = {"latest_year": None, "latest_val": None, "yoy": None, "cagr": None}
+    vals = df["value"].to_numpy(dtype="float64")
+    dates = df["date"].to_numpy()
+    mask = ~np.isnan(vals)
+    v, d = vals[mask], dates[mask]
+    if len(v) == 0:
+        return kpis
+    kpis["latest_year"] = int(d[-1])
+    kpis["latest_val"] = float(v[-1])
+    if len(v) >= 2 and not math.isclose(v[-2], 0.0):
+        kpis["yoy"] = float((v[-1] - v[-2]) / v[-2] * 100.0)
+    idx_start = int(np.searchsorted(d, d[-1] - n))
+    years = int(d[-1] - d[idx_start])
+    if len(v) - idx_start >= 2 and years > 0 and not math.isclose(v[idx_start], 0.0):
+        kpis["cagr"] = float((v[-1] / v[idx_start]) ** (1.0 / years) - 1.0)
+    return kpis
+
+def smooth_3y(df: pd.DataFrame, engine: dict) -> pd.DataFrame:
+    """Frame sorted by country/date with a per-country 3-year moving average in value_smooth."""
+    # numba's groupby-rolling output only lines up with the rows when the index is monotonic.
+    smoothed = df.sort_values(["country", "date"]).reset_index(drop=True)
+    smoothed["value_smooth"] = (
+        smoothed.groupby("country", observed=True)["value"]
+        .rolling(window=3, min_periods=1).mean(**engine)
+        .reset_index(level=0, drop=True)
+    )
+    return smoothed
 
-def yoy_change(df: pd.DataFrame) -> Optional[float]:
-    clean = df.dropna(subset=["value"]).sort_values("date")
-    if len(clean) < 2:
-        return None
-    last, prev = clean.iloc[-1]["value"], clean.iloc[-2]["value"]
-    if prev in [0, None] or (isinstance(prev, float) and math.isclose(prev, 0.0)):
-        return None
-    return ((last - prev) / prev) * 100.0
+@st.cache_resource(show_spinner=False)
+def _warm_rolling_jit() -> bool:
+    """Compile the numba rolling-mean kernel once so the first smoothing toggle isn't slow.
 
-def cagr_from_last_n_years(df: pd.DataFrame, n: int = 5) -> Optional[float]:
-    clean = df.dropna(subset=["value"]).sort_values("date")
-    if len(clean) == 0:
-        return None
-    last_year = int(clean.iloc[-1]["date"])
-    first_year = last_year - n
-    window = clean[clean["date"].between(first_year, last_year, inclusive="both")]
-    if len(window) < 2:
-        return None
-    start_val = window.iloc[0]["value"]
-    end_val = window.iloc[-1]["value"]
-    years = int(window.iloc[-1]["date"] - window.iloc[0]["date"])
-    if years <= 0 or start_val in [0, None] or (isinstance(start_val, float) and math.isclose(start_val, 0.0)):
-        return None
-    return (end_val / start_val) ** (1.0 / years) - 1.0
+    Also checks that each country's smoothed values come from its own rows: the dummy's index
+    order (b before a) differs from its sort order, as ISO vs label order does in the panel.
+    Returns False (use the default engine) if numba and cython disagree.
+    """
+    dummy = pd.DataFrame({"country": pd.Categorical(["b", "b", "a", "a"], categories=["a", "b"]),
+                          "date": [2000, 2001, 2000, 2001], "value": [1.0, 2.0, 10.0, 20.0]})
+    fast = smooth_3y(dummy, ROLLING_ENGINE)["value_smooth"].to_numpy()
+    return bool(np.allclose(fast, smooth_3y(dummy, {})["value_smooth"].to_numpy())
+                and np.allclose(fast, [10.0, 15.0, 1.0, 1.5]))
+
+_SCALES = ((1e12, "T"), (1e9, "B"), (1e6, "M"))
 
 def format_val(val, unit: str) -> str:
-    if val is None or (isinstance(val, float) and math.isnan(val)):
+    if val is None or val != val:  # val != val only for NaN
         return "—"
     if unit in ("US$", ""):
-        absval = abs(val); sign = "-" if val < 0 else ""
-        if absval >= 1e12: return f"{sign}{absval/1e12:.2f}T"
-        if absval >= 1e9:  return f"{sign}{absval/1e9:.2f}B"
-        if absval >= 1e6:  return f"{sign}{absval/1e6:.2f}M"
+        absval = abs(val)
+        for thr, suffix in _SCALES:
+            if absval >= thr:
+                return f"{'-' if val < 0 else ''}{absval / thr:.2f}{suffix}"
         return f"{val:,.0f}"
     if unit in ("%", "yrs", "t"):
         return f"{val:.2f}"
@@ -181,24 +400,46 @@ def extend_forecast(df: pd.DataFrame, years_ahead: int, cagr: Optional[float]) -
     clean = df.dropna(subset=["value"]).sort_values("date").copy()
     if clean.empty:
         return df.copy()
-    last_year = int(clean.iloc[-1]["date"])
-    last_val = float(clean.iloc[-1]["value"])
-    add_rows = []
-    for i in range(1, years_ahead + 1):
-        y = last_year + i
-        last_val = last_val * (1.0 + cagr)
-        add_rows.append({"country": clean.iloc[-1]["country"], "iso3": clean.iloc[-1]["iso3"],
-                         "indicator": clean.iloc[-1]["indicator"], "date": y, "value": last_val})
-    return pd.concat([clean, pd.DataFrame(add_rows)], ignore_index=True) if add_rows else clean
-
-def peer_median_series(df_peers: pd.DataFrame) -> Optional[pd.DataFrame]:
-    """Return per-year median of peer countries as a series (country='Peer median')."""
-    df = df_peers.dropna(subset=["value"])
-    if df.empty:
-        return None
-    med = df.groupby("date", as_index=False)["value"].median()
-    med["country"] = "Peer median"
-    return med[["country", "date", "value"]]
+    if years_ahead <= 0:
+        return clean
+    last = clean.iloc[-1]
+    last_year = int(last["date"])
+    new_vals = float(last["value"]) * np.cumprod(np.full(years_ahead, 1.0 + cagr))
+    new_years = np.arange(last_year + 1, last_year + years_ahead + 1)
+    add = pd.DataFrame({"country": last["country"], "iso3": last["iso3"], "indicator": last["indicator"],
+                        "date": new_years, "value": new_vals})
+    return pd.concat([clean, add], ignore_index=True)
+
+@st.cache_data(show_spinner=False, ttl=60 * 60)
+def peer_median_cached(peers: Tuple[str, ...], indicator_code: str, yr1: int, yr2: int,
+                       data_version: Optional[str], _df_peers: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-year median of peer countries as (years, medians); keyed on peer set, year range and data version."""
+    v = _df_peers["value"].to_numpy(dtype="float64")
+    y = _df_peers["date"].to_numpy().astype(np.int32)
+    mask = ~np.isnan(v)
+    v, y = v[mask], y[mask]
+    if len(v) == 0:
+        return np.empty(0, dtype=np.int32), np.empty(0)
+    order = np.argsort(y, kind="stable")
+    y, v = y[order], v[order]
+    uy, idx = np.unique(y, return_index=True)
+    med = np.array([np.median(v[a:b]) for a, b in zip(idx, np.r_[idx[1:], len(y)])])
+    return uy, med
+
+def country_traces(df: pd.DataFrame, colors: Dict[str, str], y: str = "value",
+                   mode: str = "lines", dash: Optional[str] = None,
+                   showlegend: bool = True) -> List[go.Scatter]:
+    """One Scatter per country, coloured via `colors` so every chart agrees on a country's colour."""
+    return [
+        go.Scatter(x=g["date"], y=g[y], name=str(name), legendgroup=str(name), showlegend=showlegend,
+                   mode=mode, line=dict(color=colors.get(str(name)), dash=dash))
+        for name, g in df.groupby("country", observed=True, sort=False)
+    ]
+
+@st.cache_data(show_spinner=False, ttl=60 * 60)
+def to_csv_bytes(key: tuple, _df: pd.DataFrame) -> bytes:
+    """CSV export of the filtered frame; `key` identifies its contents (countries, indicator, years, data version)."""
+    return _df.sort_values(["country", "date"]).to_csv(index=False).encode("utf-8")
 
 # ======================
 # Sidebar Controls (form)
@@ -214,7 +455,7 @@ def _get_qp_val(qp, key: str) -> Optional[str]:
 def init_defaults():
     if "controls" not in st.session_state:
         st.session_state.controls = {
-            "indicator_label": list(INDICATORS.keys())[0],
+            "indicator_label": _INDICATOR_LABELS[0],
             "preset_choice": "None",
             "manual_peers": [],
             "yr1": 2000,
@@ -261,11 +502,11 @@ def controls_form() -> dict:
     with st.sidebar:
         st.header("Controls")
         with st.form("controls_form", clear_on_submit=False):
-            indicator_label = st.selectbox("Indicator", list(INDICATORS.keys()),
-                                           index=list(INDICATORS.keys()).index(c["indicator_label"]))
-            preset_choice = st.selectbox("Peer preset (optional)", ["None"] + list(PRESETS.keys()),
-                                         index=(["None"] + list(PRESETS.keys())).index(c["preset_choice"]))
-            manual_peers = st.multiselect("Compare with (add/remove)", list(PEERS.keys()), default=c["manual_peers"])
+            indicator_label = st.selectbox("Indicator", _INDICATOR_LABELS,
+                                           index=_INDICATOR_INDEX[c["indicator_label"]])
+            preset_choice = st.selectbox("Peer preset (optional)", _PRESET_OPTIONS,
+                                         index=_PRESET_INDEX[c["preset_choice"]])
+            manual_peers = st.multiselect("Compare with (add/remove)", _PEER_NAMES, default=c["manual_peers"])
             yr1, yr2 = st.slider("Year range", MIN_YEAR, MAX_YEAR, (c["yr1"], c["yr2"]), step=1)
             log_scale = st.toggle("Log scale (y)", value=c["log_scale"])
             smooth3 = st.toggle("3-year smoothing overlay", value=c["smooth3"],
@@ -279,7 +520,7 @@ def controls_form() -> dict:
         with col_a:
             if st.button("Reset"):
                 st.session_state.controls = {
-                    "indicator_label": list(INDICATORS.keys())[0],
+                    "indicator_label": _INDICATOR_LABELS[0],
                     "preset_choice": "None",
                     "manual_peers": [],
                     "yr1": 2000,
@@ -297,10 +538,7 @@ def controls_form() -> dict:
                 if c["preset_choice"] != "None":
                     peers_iso += PRESETS[c["preset_choice"]]
                 peers_iso += [PEERS[k] for k in c["manual_peers"]]
-                seen = set(); peers_iso_clean = []
-                for iso in peers_iso:
-                    if iso not in seen:
-                        peers_iso_clean.append(iso); seen.add(iso)
+                peers_iso_clean = list(dict.fromkeys(peers_iso))
 
                 params = {"ind": ind_code, "yr1": c["yr1"], "yr2": c["yr2"],
                           "theme": c["chart_theme"].lower(), "median": (1 if c["show_median"] else 0)}
@@ -331,6 +569,7 @@ def controls_form() -> dict:
 st.title("🇮🇳 India Indicators Dashboard")
 st.caption("World Bank API • Cached • 3.8/3.9 compatible • Theme & peer-median options")
 
+_warm_rolling_jit()
 controls = controls_form()
 indicator_label = controls["indicator_label"]
 preset_choice = controls["preset_choice"]
@@ -347,21 +586,22 @@ countries = [DEFAULT_COUNTRY]
 if preset_choice != "None":
     countries += PRESETS[preset_choice]
 countries += [PEERS[k] for k in manual_peers]
-seen = set(); dedup = []
-for c in countries:
-    if c not in seen:
-        dedup.append(c); seen.add(c)
-countries = dedup
+countries = list(dict.fromkeys(countries))
 
 with st.spinner("Fetching data from World Bank…"):
     try:
-        df_all = wb_fetch_multi(countries, ind_code)
+        panel_key = tuple(sorted(countries))
+        raw_attrs = wb_fetch_multi(list(panel_key), ind_code).attrs
+        data_version, stale_as_of = raw_attrs.get("version"), raw_attrs.get("stale_as_of")
+        df_all = build_panel(panel_key, ind_code, data_version)
     except Exception as e:
         st.error(f"Failed to retrieve data. Please try again or adjust your selection.\n\nError: {e}")
         st.stop()
 
-df_all = df_all[(df_all["date"] >= yr1) & (df_all["date"] <= yr2)]
-df_all["country"] = df_all["iso3"].map(COUNTRY_LABELS).fillna(df_all["country"])
+if stale_as_of:
+    st.warning(f"Showing cached data from {stale_as_of} — upstream unavailable.")
+
+df_all = df_all[(df_all["date"] >= yr1) & (df_all["date"] <= yr2)].copy()
 
 if df_all.empty:
     st.warning("No data available for your current selection. Try changing the year range or peers.")
@@ -369,16 +609,23 @@ if df_all.empty:
 
 df_ind = df_all[df_all["iso3"] == DEFAULT_COUNTRY]
 df_peers = df_all[df_all["iso3"] != DEFAULT_COUNTRY]
+peer_key = tuple(sorted(c for c in countries if c != DEFAULT_COUNTRY))
 
-latest_row = latest_non_null(df_ind)
-yoy = yoy_change(df_ind)
-cagr5 = cagr_from_last_n_years(df_ind, n=5)
-latest_year = int(latest_row["date"]) if latest_row is not None else None
-latest_val = latest_row["value"] if latest_row is not None else None
+kpis = india_kpis(df_ind, n=5)
+latest_year, latest_val = kpis["latest_year"], kpis["latest_val"]
+yoy, cagr5 = kpis["yoy"], kpis["cagr"]
 
-tab1, tab2, tab3, tab4 = st.tabs(["Overview", "Compare", "Forecast", "Data & Glossary"])
+# A radio (unlike st.tabs) lets each rerun build only the section being viewed.
+view = st.radio("View", VIEWS, horizontal=True, key="view", label_visibility="collapsed")
 
-with tab1:
+if view in ("Overview", "Forecast"):
+    palette = px.colors.qualitative.Plotly
+    country_colors = {str(name): palette[i % len(palette)] for i, name in enumerate(df_all["country"].cat.categories)}
+    base_traces = country_traces(df_all, country_colors)
+    india_label = COUNTRY_LABELS[DEFAULT_COUNTRY]
+    line_layout = dict(template=template, xaxis_title="Year", yaxis_title=indicator_label, legend_title_text="country")
+
+if view == "Overview":
     k1, k2, k3, k4 = st.columns(4)
     with k1: st.metric("Latest", format_val(latest_val, unit) + (f" {unit}" if unit in ("US$", "%", "t") else ""))
     with k2: st.metric("Year", latest_year if latest_year else "—")
@@ -386,30 +633,19 @@ with tab1:
     with k4: st.metric("5y CAGR", f"{cagr5*100:.2f}%" if cagr5 is not None else "—")
 
     st.markdown("#### Trend")
-    plot_df = df_all.copy()
 
     # Base chart
-    fig = px.line(plot_df, x="date", y="value", color="country",
-                  labels={"date": "Year", "value": indicator_label},
-                  template=template)
+    fig = go.Figure(base_traces).update_layout(**line_layout)
     # Optional smoothing overlay
     if smooth3:
-        smoothed = (
-            plot_df.sort_values(["country", "date"])
-            .groupby("country", as_index=False)
-            .apply(lambda g: g.assign(value_smooth=g["value"].rolling(window=3, min_periods=1).mean()))
-            .reset_index(drop=True)
-        )
-        fig2 = px.line(smoothed, x="date", y="value_smooth", color="country", template=template)
-        for tr in fig2.data:
-            tr.update(line=dict(dash="dash"))
-            fig.add_trace(tr)
+        smoothed = smooth_3y(df_all, ROLLING_ENGINE if _warm_rolling_jit() else {})
+        fig.add_traces(country_traces(smoothed, country_colors, y="value_smooth", dash="dash", showlegend=False))
     # Peer median reference line
     if show_median:
-        med = peer_median_series(df_peers)
-        if med is not None and not med.empty:
+        med_years, med_vals = peer_median_cached(peer_key, ind_code, yr1, yr2, data_version, df_peers)
+        if len(med_years):
             fig.add_trace(go.Scatter(
-                x=med["date"], y=med["value"], name="Peer median",
+                x=med_years, y=med_vals, name="Peer median",
                 mode="lines+markers", line=dict(width=3, dash="dot")
             ))
 
@@ -423,12 +659,12 @@ with tab1:
     st.markdown("#### Quick insight")
     st.info(quick_insight(indicator_label, latest_year, format_val(latest_val, unit), yoy, cagr5, unit))
 
-with tab2:
+if view == "Compare":
     st.subheader("Latest value comparison")
     latest_vals = (
         df_all.dropna(subset=["value"])
         .sort_values(["country", "date"])
-        .groupby("country", as_index=False)
+        .groupby("country", as_index=False, observed=True)
         .tail(1)[["country", "date", "value"]]
         .sort_values("value", ascending=False)
     )
@@ -445,20 +681,20 @@ with tab2:
         with st.expander("Latest values table"):
             st.dataframe(latest_vals.reset_index(drop=True), use_container_width=True)
 
-with tab3:
+if view == "Forecast":
     st.subheader("Simple forecast (CAGR-based)")
     years_ahead = st.slider("Years to project", 1, 10, 5, step=1)
     df_ind_ext = extend_forecast(df_ind, years_ahead, cagr5)
-    df_for_plot = pd.concat([df_ind_ext, df_peers], ignore_index=True)
-    fig3 = px.line(df_for_plot, x="date", y="value", color="country",
-                   labels={"date": "Year", "value": indicator_label},
-                   markers=True, template=template)
+    # Peers reuse the Overview traces; only India's (extended) trace is rebuilt.
+    fig3 = go.Figure(country_traces(df_ind_ext, country_colors)
+                     + [tr for tr in base_traces if tr.name != india_label])
+    fig3.update_traces(mode="lines+markers").update_layout(**line_layout)
     # Optional peer median (no forecast for median)
     if show_median:
-        med = peer_median_series(df_peers)
-        if med is not None and not med.empty:
+        med_years, med_vals = peer_median_cached(peer_key, ind_code, yr1, yr2, data_version, df_peers)
+        if len(med_years):
             fig3.add_trace(go.Scatter(
-                x=med["date"], y=med["value"], name="Peer median",
+                x=med_years, y=med_vals, name="Peer median",
                 mode="lines+markers", line=dict(width=3, dash="dot")
             ))
     if log_scale:
@@ -467,18 +703,22 @@ with tab3:
     st.plotly_chart(fig3, use_container_width=True)
     st.caption("Uses India’s 5-year CAGR (if available) to extend the series. Peers are not forecasted.")
 
-with tab4:
+if view == "Data & Glossary":
     st.subheader("Data & Downloads")
-    csv_bytes = df_all.sort_values(["country", "date"]).to_csv(index=False).encode("utf-8")
-    st.download_button("Download filtered data (CSV)", data=csv_bytes,
-                       file_name=f"india_indicators_{ind_code}_{yr1}_{yr2}.csv", mime="text/csv")
+    csv_key = (panel_key, ind_code, yr1, yr2, data_version)
+    if st.session_state.get("csv_key") == csv_key:
+        st.download_button("Download filtered data (CSV)", data=to_csv_bytes(csv_key, df_all),
+                           file_name=f"india_indicators_{ind_code}_{yr1}_{yr2}.csv", mime="text/csv")
+    elif st.button("Prepare CSV download"):
+        st.session_state.csv_key = csv_key
+        st.rerun()
     st.markdown("**Source:** World Bank Open Data API")
     st.write(f"Indicator code: `{ind_code}`")
     st.markdown("**Glossary**")
     st.write(GLOSSARY.get(ind_code, "—"))
     with st.expander("Methodology"):
         st.markdown(
-            "- Values come directly from the World Bank API (v2) and are cached for 1 hour.\n"
+            "- Values come directly from the World Bank API (v2) and are cached for 6 hours to 7 days, depending on how often the indicator changes.\n"
             "- KPI YoY compares the last two available points.\n"
             "- 5-year CAGR uses the first and last values available in the last 5-year window.\n"
             "- Forecast extends India’s series by compounding the 5-year CAGR.\n"